@@ -2,11 +2,11 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
-from json import JSONDecodeError
-from typing import AsyncGenerator, Iterable
-from uuid import uuid4
+from typing import AsyncGenerator
+
+import orjson
+from orjson import JSONDecodeError
 
 from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
@@ -14,31 +14,45 @@ from fastapi.responses import JSONResponse, StreamingResponse
 
 from settings import settings
 
-from core.anti_replay import AntiReplayMiddleware
-from core.csrf import ensure_csrf_cookie, ensure_csrf_cookie_from_request, require_csrf
+from core.anti_replay import AntiReplayMiddleware, issue_nonce
+from core.csrf import ensure_csrf_cookie, require_csrf
+from core.log_queue import register_logging_events
+from core.observability import ObservabilityMiddleware
 from core.rate_limit import RateLimitMiddleware
 from core.sessions import SessionMiddleware, register_session_events
 
 logger = logging.getLogger("chat-backend")
 logging.basicConfig(level=settings.log_level.upper())
 
+# JSON \uXXXX escapes can spend up to 6 payload bytes per message byte, so
+# anything beyond that (plus room for the envelope) cannot hold a valid message.
+MAX_PAYLOAD_BYTES = settings.max_message_bytes * 6 + 64
+
 PLACEHOLDER_TEXT = (
     "This is a placeholder response from the backend. Your message was received and the "
     "streaming is working. Replace this with real AI output when ready."
 )
 CHUNK_SIZE = 24
-
-
-def chunk_text(text: str, size: int) -> Iterable[str]:
-    for index in range(0, len(text), size):
-        yield text[index : index + size]
+PLACEHOLDER_CHUNKS = tuple(
+    PLACEHOLDER_TEXT[index : index + CHUNK_SIZE].encode("utf-8")
+    for index in range(0, len(PLACEHOLDER_TEXT), CHUNK_SIZE)
+)
+PLACEHOLDER_BYTES = PLACEHOLDER_TEXT.encode("utf-8")
 
 
 def message_too_large(message: str) -> bool:
+    # Every code point encodes to 1-4 UTF-8 bytes, so only encode when the
+    # character count alone cannot decide.
+    length = len(message)
+    if length * 4 <= settings.max_message_bytes:
+        return False
+    if length > settings.max_message_bytes:
+        return True
     return len(message.encode("utf-8")) > settings.max_message_bytes
 
 
 app = FastAPI()
+register_logging_events(app)
 register_session_events(app)
 
 app.add_middleware(RateLimitMiddleware)
@@ -51,49 +65,12 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ObservabilityMiddleware)
 
 
-@app.middleware("http")
-async def add_request_logging(request: Request, call_next):  # type: ignore[override]
-    request_id = str(uuid4())
-    request.state.request_id = request_id
-    logger.info(
-        "request.start",
-        extra={
-            "path": request.url.path,
-            "method": request.method,
-            "client": request.client.host if request.client else None,
-            "request_id": request_id,
-        },
-    )
-    try:
-        response = await call_next(request)
-    except Exception:
-        logger.exception("request.error", extra={"request_id": request_id})
-        raise
-    response.headers["X-Request-Id"] = request_id
-    logger.info(
-        "request.end",
-        extra={
-            "path": request.url.path,
-            "method": request.method,
-            "status_code": response.status_code,
-            "request_id": request_id,
-        },
-    )
-    return response
-
-
-@app.middleware("http")
-async def ensure_csrf_cookie_middleware(request: Request, call_next):  # type: ignore[override]
-    response = await call_next(request)
-    ensure_csrf_cookie_from_request(request, response)
-    return response
-
-
-async def stream_placeholder(delay: float) -> AsyncGenerator[str, None]:
+async def stream_placeholder(delay: float) -> AsyncGenerator[bytes, None]:
     try:
-        for chunk in chunk_text(PLACEHOLDER_TEXT, CHUNK_SIZE):
+        for chunk in PLACEHOLDER_CHUNKS:
             yield chunk
             await asyncio.sleep(delay)
     finally:
@@ -111,13 +88,15 @@ async def csrf_seed(response: Response):
     return {"csrf": token}
 
 
+@app.get("/nonce")
+async def nonce_seed(request: Request):
+    return {"nonce": issue_nonce(request.state.sid, request.state.session)}
+
+
 @app.get("/me")
 async def me(request: Request):
-    session = getattr(request.state, "session", {})
-    if not isinstance(session, dict):
-        session = {}
-
-    user_id = session.get("user_id")
+    session = getattr(request.state, "session", None)
+    user_id = getattr(session, "user_id", None)
     return {"anonymous": user_id is None, "user_id": user_id}
 
 
@@ -131,9 +110,11 @@ async def chat_endpoint(request: Request):
 
     if not payload:
         raise HTTPException(status_code=400, detail="Request body is required")
+    if len(payload) > MAX_PAYLOAD_BYTES:
+        raise HTTPException(status_code=400, detail="Payload too large")
 
     try:
-        data = json.loads(payload)
+        data = orjson.loads(payload)
     except JSONDecodeError as exc:
         raise HTTPException(status_code=400, detail="Invalid JSON payload") from exc
 
@@ -149,6 +130,14 @@ async def chat_endpoint(request: Request):
 
     delay_seconds = max(settings.delay_ms, 0) / 1000
 
+    if delay_seconds == 0:
+        # Nothing to pace, so send the whole body in a single frame.
+        return Response(
+            content=PLACEHOLDER_BYTES,
+            media_type="text/plain; charset=utf-8",
+            headers={"Cache-Control": "no-cache"},
+        )
+
     response = StreamingResponse(
         stream_placeholder(delay_seconds),
         media_type="text/plain; charset=utf-8",
@@ -1,74 +1,192 @@
 """Replay protection middleware."""
 from __future__ import annotations
 
+import hashlib
+import heapq
+import hmac
 import logging
 import os
+import re
+import secrets
 import time
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import ASGIApp
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from core.asgi import client_host, get_cookie, scope_state, send_status
+from core.sessions import SESSION_COOKIE_NAME, SESSIONS, Session
 
 
 LOGGER = logging.getLogger("chat-backend.anti-replay")
 
 MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
 FRESHNESS_WINDOW = int(os.getenv("FRESHNESS_WINDOW", "300"))
-NONCES: Dict[str, float] = {}
-
-
-class AntiReplayMiddleware(BaseHTTPMiddleware):
+ANTI_REPLAY_MAX_NONCES = int(os.getenv("ANTI_REPLAY_MAX_NONCES", "100000"))
+ANTI_REPLAY_MAX_NONCES_PER_IP = int(os.getenv("ANTI_REPLAY_MAX_NONCES_PER_IP", "500"))
+# Nonces are keyed by their 64-bit hash(): the interpreter's keyed SipHash
+# makes crafted collisions impractical and keeps keys to a small int.
+NONCES: Dict[int, int] = {}
+# Key for server-issued nonces; set NONCE_SECRET when running several workers.
+NONCE_SECRET = os.getenv("NONCE_SECRET", "").encode() or secrets.token_bytes(32)
+# Exact shape of a server-issued nonce; anything else is treated as opaque.
+_SIGNED_NONCE = re.compile(rb"(\d+):(\d+):([0-9a-f]{16})")
+# (expires, nonce, client) min-heap so expiry only touches nonces that are due
+_NONCE_HEAP: List[Tuple[int, int, str]] = []
+# live cached nonces per client address, for the per-IP quota
+_NONCES_PER_IP: Dict[str, int] = {}
+
+
+def _purge_nonces(now: int) -> None:
+    while _NONCE_HEAP and _NONCE_HEAP[0][0] <= now:
+        expires, key, client = heapq.heappop(_NONCE_HEAP)
+        if NONCES.get(key) == expires:
+            del NONCES[key]
+            remaining = _NONCES_PER_IP.pop(client, 1) - 1
+            if remaining:
+                _NONCES_PER_IP[client] = remaining
+
+
+def _remember_nonce(nonce_key: int, expires: int, client: str) -> Optional[str]:
+    """Record ``nonce_key``; return a rejection reason if it cannot be accepted.
+
+    Limits fail closed: evicting a live nonce would let it be replayed. The
+    per-IP quota is checked first so one client cannot fill the shared cache.
+    Every cached nonce has exactly one heap entry, so the cap bounds both.
+    """
+
+    if nonce_key in NONCES:
+        return "nonce_reuse"
+    held = _NONCES_PER_IP.get(client, 0)
+    if 0 < ANTI_REPLAY_MAX_NONCES_PER_IP <= held:
+        return "nonce_quota_exceeded"
+    if 0 < ANTI_REPLAY_MAX_NONCES <= len(NONCES):
+        return "nonce_cache_full"
+    NONCES[nonce_key] = expires
+    _NONCES_PER_IP[client] = held + 1
+    heapq.heappush(_NONCE_HEAP, (expires, nonce_key, client))
+    return None
+
+
+def _sign_nonce(ts_value: int, seq: int, sid: str) -> str:
+    message = f"{ts_value}:{seq}:{sid}".encode()
+    return hmac.new(NONCE_SECRET, message, hashlib.sha256).hexdigest()[:16]
+
+
+def issue_nonce(sid: str, session: Session) -> str:
+    """Issue a signed ``ts:seq:mac`` nonce bound to the given session."""
+
+    session.nonce_seq += 1
+    ts_value = int(time.time())
+    seq = session.nonce_seq
+    return f"{ts_value}:{seq}:{_sign_nonce(ts_value, seq, sid)}"
+
+
+def _accept_signed_nonce(scope: Scope, signed: re.Match, now: int) -> Optional[str]:
+    """Verify a signed nonce statelessly; return a rejection reason if invalid.
+
+    Only the session's highest accepted ``seq`` is stored.
+    """
+
+    ts_part, seq_part, mac = signed.groups()
+    ts_value, seq = int(ts_part), int(seq_part)
+    if abs(now - ts_value) > FRESHNESS_WINDOW:
+        return "stale_nonce"
+
+    raw_sid = get_cookie(scope, SESSION_COOKIE_NAME.encode())
+    if not raw_sid:
+        return "unknown_session"
+    sid = raw_sid.decode("latin-1")
+    if not hmac.compare_digest(mac, _sign_nonce(ts_value, seq, sid).encode()):
+        return "invalid_nonce"
+
+    session = SESSIONS.get(sid)
+    if session is None:
+        return "unknown_session"
+    if seq <= session.max_seq:
+        return "nonce_reuse"
+    session.max_seq = seq
+    return None
+
+
+class AntiReplayMiddleware:
     """Rejects requests that reuse nonces or stale timestamps."""
 
-    async def dispatch(self, request: Request, call_next):  # type: ignore[override]
-        if request.method not in MUTATING_METHODS:
-            return await call_next(request)
-
-        client_host = request.client.host if request.client else "unknown"
-        sid_prefix = getattr(request.state, "sid", "")[:8]
-
-        ts_header = request.headers.get("X-TS")
-        nonce = request.headers.get("X-Nonce")
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        _now=time.time,
+        _log=LOGGER.info,
+    ) -> None:
+        if scope["type"] != "http" or scope["method"] not in MUTATING_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        client = client_host(scope)
+        sid_prefix = scope_state(scope).get("sid", "")[:8]
+
+        # one pass over the raw headers, first value wins as with headers.get();
+        # values stay bytes (int() accepts them)
+        ts_header = nonce = None
+        for key, value in scope["headers"]:
+            if key == b"x-ts":
+                if ts_header is None:
+                    ts_header = value
+            elif key == b"x-nonce":
+                if nonce is None:
+                    nonce = value
+            else:
+                continue
+            if ts_header is not None and nonce is not None:
+                break
 
         if not ts_header or not nonce:
-            LOGGER.info(
+            _log(
                 "anti_replay.reject",
-                extra={"reason": "missing_headers", "ip": client_host, "sid": sid_prefix},
+                extra={"reason": "missing_headers", "ip": client, "sid": sid_prefix},
             )
-            return Response(status_code=401)
+            await send_status(send, 401)
+            return
 
         try:
             ts_value = int(ts_header)
         except ValueError:
-            LOGGER.info(
+            _log(
                 "anti_replay.reject",
-                extra={"reason": "invalid_ts", "ip": client_host, "sid": sid_prefix},
+                extra={"reason": "invalid_ts", "ip": client, "sid": sid_prefix},
             )
-            return Response(status_code=401)
+            await send_status(send, 401)
+            return
 
-        now = int(time.time())
+        now = int(_now())
         if abs(now - ts_value) > FRESHNESS_WINDOW:
-            LOGGER.info(
+            _log(
                 "anti_replay.reject",
-                extra={"reason": "stale_ts", "ip": client_host, "sid": sid_prefix},
+                extra={"reason": "stale_ts", "ip": client, "sid": sid_prefix},
             )
-            return Response(status_code=401)
-
-        # purge expired nonces lazily
-        expired = [key for key, expires in NONCES.items() if expires <= now]
-        for key in expired:
-            NONCES.pop(key, None)
-
-        if nonce in NONCES:
-            LOGGER.info(
+            await send_status(send, 401)
+            return
+
+        signed = _SIGNED_NONCE.fullmatch(nonce)
+        if signed is not None:
+            reason = _accept_signed_nonce(scope, signed, now)
+        else:
+            _purge_nonces(now)
+            reason = _remember_nonce(hash(nonce), now + FRESHNESS_WINDOW, client)
+
+        if reason is not None:
+            _log(
                 "anti_replay.reject",
-                extra={"reason": "nonce_reuse", "ip": client_host, "sid": sid_prefix},
+                extra={"reason": reason, "ip": client, "sid": sid_prefix},
             )
-            return Response(status_code=401)
+            await send_status(send, 401)
+            return
 
-        NONCES[nonce] = now + FRESHNESS_WINDOW
-        return await call_next(request)
+        await self.app(scope, receive, send)
 
 
-__all__ = ["AntiReplayMiddleware", "FRESHNESS_WINDOW", "NONCES"]
+__all__ = ["AntiReplayMiddleware", "FRESHNESS_WINDOW", "NONCES", "issue_nonce"]
@@ -0,0 +1,56 @@
+"""Small helpers shared by the pure ASGI middlewares."""
+from __future__ import annotations
+
+from typing import Optional
+
+from starlette.types import Scope, Send
+
+
+def client_host(scope: Scope) -> str:
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def get_header(scope: Scope, name: bytes) -> Optional[bytes]:
+    """Return the first raw value of ``name`` (lower-case) from the scope headers."""
+
+    for key, value in scope["headers"]:
+        if key == name:
+            return value
+    return None
+
+
+def get_cookie(scope: Scope, name: bytes) -> Optional[bytes]:
+    """Return the raw value of cookie ``name`` without parsing the whole jar."""
+
+    prefix = name + b"="
+    for key, value in scope["headers"]:
+        if key != b"cookie":
+            continue
+        for pair in value.split(b";"):
+            pair = pair.strip()
+            if pair.startswith(prefix):
+                return pair[len(prefix) :]
+    return None
+
+
+def scope_state(scope: Scope) -> dict:
+    """Return the dict backing ``request.state`` for this scope."""
+
+    return scope.setdefault("state", {})
+
+
+async def send_status(send: Send, status: int) -> None:
+    """Send an empty-bodied response without building a Starlette ``Response``."""
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-length", b"0")],
+        }
+    )
+    await send({"type": "http.response.body", "body": b""})
+
+
+__all__ = ["client_host", "get_cookie", "get_header", "scope_state", "send_status"]
@@ -8,11 +8,16 @@ from typing import Optional
 
 from fastapi import HTTPException, Request
 from fastapi.responses import Response
+from starlette.datastructures import MutableHeaders
+from starlette.types import Message, Scope
 
+from core.asgi import get_cookie, get_header
+from core.tokens import token_hex
 
 LOGGER = logging.getLogger("chat-backend.csrf")
 
 CSRFTOKEN_COOKIE_NAME = "csrftoken"
+_CSRFTOKEN_COOKIE_KEY = CSRFTOKEN_COOKIE_NAME.encode()
 MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
 CSRF_COOKIE_MAX_AGE = 7 * 24 * 3600
 
@@ -22,7 +27,7 @@ def _cookie_secure() -> bool:
 
 
 def generate_csrf_token() -> str:
-    return secrets.token_hex(32)
+    return token_hex(32)
 
 
 def ensure_csrf_cookie(response: Response, token: Optional[str] = None) -> str:
@@ -47,8 +52,8 @@ async def require_csrf(request: Request) -> None:
     if request.method not in MUTATING_METHODS:
         return
 
-    cookie = request.cookies.get(CSRFTOKEN_COOKIE_NAME)
-    header = request.headers.get("X-CSRF-Token")
+    cookie = get_cookie(request.scope, _CSRFTOKEN_COOKIE_KEY)
+    header = get_header(request.scope, b"x-csrf-token")
 
     if not cookie or not header:
         LOGGER.info(
@@ -73,24 +78,32 @@ async def require_csrf(request: Request) -> None:
         raise HTTPException(status_code=403, detail="CSRF token mismatch")
 
 
-def ensure_csrf_cookie_from_request(request: Request, response: Response) -> None:
-    if CSRFTOKEN_COOKIE_NAME in request.cookies:
+def ensure_csrf_cookie_on_message(scope: Scope, message: Message) -> None:
+    """Add a csrftoken cookie to an ``http.response.start`` message when missing."""
+
+    if get_cookie(scope, _CSRFTOKEN_COOKIE_KEY) is not None:
         return
 
-    set_cookie_headers = response.headers.getlist("set-cookie")
+    headers = MutableHeaders(scope=message)
     if any(
         header.startswith(f"{CSRFTOKEN_COOKIE_NAME}=")
-        for header in set_cookie_headers
+        for header in headers.getlist("set-cookie")
     ):
         return
 
-    ensure_csrf_cookie(response)
+    cookie = (
+        f"{CSRFTOKEN_COOKIE_NAME}={generate_csrf_token()}; "
+        f"Max-Age={CSRF_COOKIE_MAX_AGE}; Path=/; SameSite=lax"
+    )
+    if _cookie_secure():
+        cookie += "; Secure"
+    headers.append("set-cookie", cookie)
 
 
 __all__ = [
     "CSRFTOKEN_COOKIE_NAME",
     "ensure_csrf_cookie",
-    "ensure_csrf_cookie_from_request",
+    "ensure_csrf_cookie_on_message",
     "generate_csrf_token",
     "require_csrf",
 ]
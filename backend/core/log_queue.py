@@ -0,0 +1,58 @@
+"""Move log output off the event loop via a queue-backed handler."""
+from __future__ import annotations
+
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Optional
+
+_LISTENER: Optional[QueueListener] = None
+_HANDLERS: List[logging.Handler] = []
+
+
+def _start_listener() -> None:
+    global _LISTENER
+    if _LISTENER is not None:
+        return
+
+    root = logging.getLogger()
+    _HANDLERS[:] = root.handlers
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    for handler in _HANDLERS:
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+
+    _LISTENER = QueueListener(log_queue, *_HANDLERS, respect_handler_level=True)
+    _LISTENER.start()
+
+
+def _stop_listener() -> None:
+    global _LISTENER
+    if _LISTENER is None:
+        return
+
+    _LISTENER.stop()
+    _LISTENER = None
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, QueueHandler):
+            root.removeHandler(handler)
+    for handler in _HANDLERS:
+        root.addHandler(handler)
+    _HANDLERS.clear()
+
+
+def register_logging_events(app) -> None:
+    """Write log records from a background thread while the app is running."""
+
+    @app.on_event("startup")
+    async def _start_log_listener() -> None:  # pragma: no cover - event hook
+        _start_listener()
+
+    @app.on_event("shutdown")
+    async def _stop_log_listener() -> None:  # pragma: no cover - event hook
+        _stop_listener()
+
+
+__all__ = ["register_logging_events"]
@@ -0,0 +1,92 @@
+"""Request logging and CSRF cookie seeding middleware."""
+from __future__ import annotations
+
+import itertools
+import logging
+import os
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.asgi import scope_state
+from core.csrf import ensure_csrf_cookie_on_message
+
+
+LOGGER = logging.getLogger("chat-backend")
+
+# Request ids only correlate log lines, so a per-process counter tagged with
+# the pid is enough and avoids reading kernel entropy per request.
+_REQ_COUNTER = itertools.count()
+_PID = os.getpid()
+
+
+def _reset_request_ids() -> None:
+    # Pre-fork servers copy the parent's pid and counter into every worker.
+    global _REQ_COUNTER, _PID
+    _REQ_COUNTER = itertools.count()
+    _PID = os.getpid()
+
+
+os.register_at_fork(after_in_child=_reset_request_ids)
+
+
+class ObservabilityMiddleware:
+    """Tags requests with an id, logs them and seeds the csrftoken cookie."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        # the request-id counter stays global so forks can replace it
+        _log=LOGGER.info,
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = f"{_PID:x}-{next(_REQ_COUNTER):x}"
+        scope_state(scope)["request_id"] = request_id
+        path = scope["path"]
+        method = scope["method"]
+        status_code = None
+
+        _log(
+            "request.start",
+            extra={
+                "path": path,
+                "method": method,
+                "client": scope["client"][0] if scope.get("client") else None,
+                "request_id": request_id,
+            },
+        )
+
+        async def send_with_headers(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message)["x-request-id"] = request_id
+                ensure_csrf_cookie_on_message(scope, message)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        except Exception:
+            LOGGER.exception("request.error", extra={"request_id": request_id})
+            raise
+
+        _log(
+            "request.end",
+            extra={
+                "path": path,
+                "method": method,
+                "status_code": status_code,
+                "request_id": request_id,
+            },
+        )
+
+
+__all__ = ["ObservabilityMiddleware"]
@@ -4,52 +4,89 @@ from __future__ import annotations
 import logging
 import os
 import time
-from typing import Dict
+from array import array
+from collections import OrderedDict
+from typing import List
 
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import ASGIApp
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from core.asgi import client_host, scope_state, send_status
 
 
 LOGGER = logging.getLogger("chat-backend.rate-limit")
 
 RATE_LIMIT_RPS = float(os.getenv("RATE_LIMIT_RPS", "10.0"))
 RATE_LIMIT_BURST = RATE_LIMIT_RPS * 2
-_RATE_LIMIT_STATE: Dict[str, Dict[str, float]] = {}
+# Buckets hold refill time in nanoseconds: one token is worth NS_PER_TOKEN.
+NS_PER_TOKEN = int(1e9 / RATE_LIMIT_RPS) if RATE_LIMIT_RPS > 0 else 0
+BURST_NS = int(RATE_LIMIT_BURST * NS_PER_TOKEN)
+RATE_LIMIT_MAX_IPS = int(os.getenv("RATE_LIMIT_MAX_IPS", "100000"))
+
+# Bucket state is kept as parallel arrays indexed by a per-IP slot; the slot
+# map doubles as an LRU so idle clients are evicted first.
+_IP_SLOT: "OrderedDict[str, int]" = OrderedDict()
+_TOKENS = array("q")
+_LAST = array("q")
+_FREE_SLOTS: List[int] = []
+
 
+def _allocate_slot(client: str) -> int:
+    if 0 < RATE_LIMIT_MAX_IPS <= len(_IP_SLOT):
+        _FREE_SLOTS.append(_IP_SLOT.popitem(last=False)[1])
+    if _FREE_SLOTS:
+        slot = _FREE_SLOTS.pop()
+    else:
+        slot = len(_TOKENS)
+        _TOKENS.append(0)
+        _LAST.append(0)
+    _IP_SLOT[client] = slot
+    return slot
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
+
+class RateLimitMiddleware:
     """Simple token-bucket rate limiter."""
 
-    async def dispatch(self, request: Request, call_next):  # type: ignore[override]
-        if RATE_LIMIT_RPS <= 0:
-            return await call_next(request)
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        _now=time.monotonic_ns,
+        _slots=_IP_SLOT,
+        _tokens=_TOKENS,
+        _last=_LAST,
+        _log=LOGGER.info,
+    ) -> None:
+        if scope["type"] != "http" or RATE_LIMIT_RPS <= 0:
+            await self.app(scope, receive, send)
+            return
 
-        client_host = request.client.host if request.client else "unknown"
-        record = _RATE_LIMIT_STATE.get(client_host)
-        now = time.time()
+        client = client_host(scope)
+        slot = _slots.get(client)
+        now = _now()
 
-        if record is None:
-            record = {"tokens": RATE_LIMIT_BURST, "ts": now}
+        if slot is None:
+            slot = _allocate_slot(client)
+            tokens = BURST_NS
         else:
-            elapsed = max(0.0, now - record["ts"])
-            record["tokens"] = min(
-                RATE_LIMIT_BURST,
-                record.get("tokens", RATE_LIMIT_BURST) + elapsed * RATE_LIMIT_RPS,
-            )
-            record["ts"] = now
+            _slots.move_to_end(client)
+            tokens = min(BURST_NS, _tokens[slot] + now - _last[slot])
+        _last[slot] = now
 
-        if record["tokens"] < 1.0:
-            LOGGER.info(
+        if tokens < NS_PER_TOKEN:
+            _log(
                 "rate_limit.reject",
-                extra={"ip": client_host, "sid": getattr(request.state, "sid", "")[:8]},
+                extra={"ip": client, "sid": scope_state(scope).get("sid", "")[:8]},
             )
-            _RATE_LIMIT_STATE[client_host] = record
-            return Response(status_code=429)
+            _tokens[slot] = tokens
+            await send_status(send, 429)
+            return
 
-        record["tokens"] -= 1.0
-        _RATE_LIMIT_STATE[client_host] = record
-        return await call_next(request)
+        _tokens[slot] = tokens - NS_PER_TOKEN
+        await self.app(scope, receive, send)
 
 
 __all__ = ["RateLimitMiddleware", "RATE_LIMIT_RPS", "RATE_LIMIT_BURST"]
@@ -2,68 +2,112 @@
 from __future__ import annotations
 
 import asyncio
+import heapq
 import os
-import secrets
 import time
-from typing import Any, Dict, Optional
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
 
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import ASGIApp
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.asgi import get_cookie, scope_state
+from core.tokens import token_urlsafe
 
 SESSION_COOKIE_NAME = "sid"
+_SESSION_COOKIE_KEY = SESSION_COOKIE_NAME.encode()
 SESSION_TTL = int(os.getenv("SESSION_TTL", "1800"))
 SESSION_GC_INTERVAL = 60
 
 
-SessionData = Dict[str, Any]
-
-
-SESSIONS: Dict[str, SessionData] = {}
+class Session:
+    """Server-side state for one session."""
+
+    __slots__ = (
+        "created_at",
+        "last_seen",
+        "cookie_set_at",
+        "user_id",
+        "nonce_seq",
+        "max_seq",
+    )
+
+    def __init__(self, now: float) -> None:
+        self.created_at = now
+        self.last_seen = now
+        self.cookie_set_at = now
+        self.user_id: Any = None
+        self.nonce_seq = 0
+        self.max_seq = 0
+
+
+SESSIONS: Dict[str, Session] = {}
+# (expires_at, sid) min-heap, owned by the GC pass. Touches do not update it;
+# entries for sessions that were seen since are rescheduled when they reach
+# the top.
+_EXPIRE_HEAP: List[Tuple[float, str]] = []
+# New sessions are handed to the GC thread through a deque, whose append and
+# popleft are thread-safe, so the event loop never waits on a lock.
+_PENDING_EXPIRY: Deque[Tuple[float, str]] = deque()
 _GC_TASK: Optional[asyncio.Task[None]] = None
 
 
 def _generate_sid() -> str:
-    return secrets.token_urlsafe(32)
+    return token_urlsafe(32)
 
 
-def _is_expired(session: SessionData, now: Optional[float] = None) -> bool:
+def _is_expired(session: Session, now: Optional[float] = None) -> bool:
     now = now or time.time()
-    return (now - session["last_seen"]) > SESSION_TTL
+    return (now - session.last_seen) > SESSION_TTL
 
 
-def _create_session() -> tuple[str, SessionData]:
-    now = time.time()
+def _create_session() -> tuple[str, Session]:
     sid = _generate_sid()
-    session: SessionData = {
-        "created_at": now,
-        "last_seen": now,
-        "user_id": None,
-    }
+    session = Session(time.time())
     SESSIONS[sid] = session
+    _PENDING_EXPIRY.append((session.last_seen + SESSION_TTL, sid))
     return sid, session
 
 
-def rotate_sid(old_sid: str) -> tuple[str, SessionData]:
+def rotate_sid(old_sid: str) -> tuple[str, Session]:
     """Rotate an existing SID to mitigate session fixation."""
 
     existing = SESSIONS.pop(old_sid, None)
     new_sid, session = _create_session()
     if existing:
-        session.update(existing)
-        session["created_at"] = existing["created_at"]
-        session["last_seen"] = time.time()
+        for name in Session.__slots__:
+            setattr(session, name, getattr(existing, name))
+        session.last_seen = session.cookie_set_at = time.time()
     return new_sid, session
 
 
+def _collect_expired(now: float) -> None:
+    while True:
+        try:
+            heapq.heappush(_EXPIRE_HEAP, _PENDING_EXPIRY.popleft())
+        except IndexError:
+            break
+
+    rescheduled = []
+    while _EXPIRE_HEAP and _EXPIRE_HEAP[0][0] <= now:
+        _, sid = heapq.heappop(_EXPIRE_HEAP)
+        session = SESSIONS.get(sid)
+        if session is None:
+            continue
+        if _is_expired(session, now):
+            SESSIONS.pop(sid, None)
+        else:
+            rescheduled.append((session.last_seen + SESSION_TTL, sid))
+    for entry in rescheduled:
+        heapq.heappush(_EXPIRE_HEAP, entry)
+
+
 async def _gc_loop() -> None:
+    loop = asyncio.get_running_loop()
     try:
         while True:
             await asyncio.sleep(SESSION_GC_INTERVAL)
-            now = time.time()
-            expired = [sid for sid, session in SESSIONS.items() if _is_expired(session, now)]
-            for sid in expired:
-                SESSIONS.pop(sid, None)
+            await loop.run_in_executor(None, _collect_expired, time.time())
     except asyncio.CancelledError:  # pragma: no cover - shutdown
         pass
 
@@ -89,42 +133,65 @@ def register_session_events(app) -> None:
             _GC_TASK = None
 
 
-class SessionMiddleware(BaseHTTPMiddleware):
+class SessionMiddleware:
     """Middleware that manages sessions stored in memory."""
 
     def __init__(self, app: ASGIApp) -> None:
-        super().__init__(app)
+        self.app = app
         self.secure_cookie = os.getenv("APP_ENV") == "prod"
-
-    async def dispatch(self, request: Request, call_next):  # type: ignore[override]
-        sid = request.cookies.get(SESSION_COOKIE_NAME)
-        now = time.time()
-        session: Optional[SessionData] = None
+        self.cookie_attrs = f"; HttpOnly; Max-Age={SESSION_TTL}; Path=/; SameSite=lax"
+        if self.secure_cookie:
+            self.cookie_attrs += "; Secure"
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        _now=time.time,
+        _sessions=SESSIONS,
+        _get_cookie=get_cookie,
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        raw_sid = _get_cookie(scope, _SESSION_COOKIE_KEY)
+        sid = raw_sid.decode("latin-1") if raw_sid else None
+        now = _now()
+        session: Optional[Session] = None
 
         if sid:
-            session = SESSIONS.get(sid)
+            session = _sessions.get(sid)
             if session and _is_expired(session, now):
-                SESSIONS.pop(sid, None)
+                _sessions.pop(sid, None)
                 session = None
         if session is None:
             sid, session = _create_session()
+            cookie_stale = True
         else:
-            session["last_seen"] = now
+            session.last_seen = now
+            # Re-issue the cookie once it is halfway through its Max-Age so
+            # active sessions keep sliding without a Set-Cookie per response.
+            cookie_stale = now - session.cookie_set_at >= SESSION_TTL / 2
+
+        state = scope_state(scope)
+        state["sid"] = sid
+        state["session"] = session
+
+        if not cookie_stale:
+            await self.app(scope, receive, send)
+            return
+
+        session.cookie_set_at = now
+        set_cookie = f"{SESSION_COOKIE_NAME}={sid}{self.cookie_attrs}"
 
-        request.state.sid = sid
-        request.state.session = session
+        async def send_with_cookie(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("set-cookie", set_cookie)
+            await send(message)
 
-        response = await call_next(request)
-        response.set_cookie(
-            SESSION_COOKIE_NAME,
-            sid,
-            httponly=True,
-            secure=self.secure_cookie,
-            samesite="lax",
-            path="/",
-            max_age=SESSION_TTL,
-        )
-        return response
+        await self.app(scope, receive, send_with_cookie)
 
 
 __all__ = [
@@ -134,4 +201,5 @@ __all__ = [
     "rotate_sid",
     "register_session_events",
     "SESSIONS",
+    "Session",
 ]
@@ -0,0 +1,44 @@
+"""Random tokens drawn from a pooled CSPRNG buffer."""
+from __future__ import annotations
+
+import base64
+import os
+import threading
+
+_POOL_SIZE = 4096
+
+
+class _TokenPool:
+    """Refills from ``os.urandom`` in blocks so each token is not a syscall."""
+
+    def __init__(self) -> None:
+        self.buf = bytearray()
+        self.lock = threading.Lock()
+
+    def draw(self, nbytes: int) -> bytes:
+        with self.lock:
+            if len(self.buf) < nbytes:
+                self.buf += os.urandom(max(_POOL_SIZE, nbytes))
+            token = bytes(self.buf[-nbytes:])
+            del self.buf[-nbytes:]
+        return token
+
+    def reset(self) -> None:
+        # A forked child must never hand out bytes its parent may also use.
+        self.lock = threading.Lock()
+        self.buf = bytearray()
+
+
+_POOL = _TokenPool()
+os.register_at_fork(after_in_child=_POOL.reset)
+
+
+def token_hex(nbytes: int = 32) -> str:
+    return _POOL.draw(nbytes).hex()
+
+
+def token_urlsafe(nbytes: int = 32) -> str:
+    return base64.urlsafe_b64encode(_POOL.draw(nbytes)).rstrip(b"=").decode("ascii")
+
+
+__all__ = ["token_hex", "token_urlsafe"]
@@ -4,7 +4,7 @@ from __future__ import annotations
 import os
 from dataclasses import dataclass
 from functools import lru_cache
-from typing import List
+from typing import Tuple
 
 
 def _env_int(name: str, default: int) -> int:
@@ -30,10 +30,7 @@ class Settings:
     log_level: str
     delay_ms: int
     max_message_bytes: int
-
-    @property
-    def cors_origin_list(self) -> List[str]:
-        return [origin.strip() for origin in self.cors_origins.split(",") if origin.strip()]
+    cors_origin_list: Tuple[str, ...]
 
 
 @lru_cache
@@ -46,12 +43,17 @@ def get_settings() -> Settings:
         )
     )
 
+    cors_origins = _env_str("CORS_ORIGINS", default_cors_origins)
+
     return Settings(
         port=_env_int("PORT", 8000),
-        cors_origins=_env_str("CORS_ORIGINS", default_cors_origins),
+        cors_origins=cors_origins,
         log_level=_env_str("LOG_LEVEL", "info"),
         delay_ms=_env_int("DELAY_MS", 80),
         max_message_bytes=_env_int("MAX_MESSAGE_BYTES", 10_240),
+        cors_origin_list=tuple(
+            origin.strip() for origin in cors_origins.split(",") if origin.strip()
+        ),
     )
 
 
@@ -1,8 +1,10 @@
 import sys
 from pathlib import Path
 
+import heapq
 import secrets
 import time
+from dataclasses import replace
 
 import pytest
 from asgi_lifespan import LifespanManager
@@ -10,7 +12,11 @@ from httpx import AsyncClient
 
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
+import app as app_module  # noqa: E402  pylint: disable=wrong-import-position
 from app import app, PLACEHOLDER_TEXT  # noqa: E402  pylint: disable=wrong-import-position
+from core import anti_replay  # noqa: E402  pylint: disable=wrong-import-position
+from core.anti_replay import issue_nonce  # noqa: E402  pylint: disable=wrong-import-position
+from core.sessions import SESSIONS, Session  # noqa: E402  pylint: disable=wrong-import-position
 
 
 @pytest.fixture
@@ -56,3 +62,268 @@ async def test_chat_streams_placeholder_text():
                 chunks.append(chunk)
     body = "".join(chunks)
     assert PLACEHOLDER_TEXT in body
+
+
+@pytest.mark.anyio
+async def test_chat_accepts_signed_nonce_once():
+    async with LifespanManager(app):
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            nonce_response = await client.get("/nonce")
+            assert nonce_response.status_code == 200
+            nonce = nonce_response.json()["nonce"]
+
+            headers = {
+                "X-CSRF-Token": client.cookies.get("csrftoken"),
+                "X-TS": str(int(time.time())),
+                "X-Nonce": nonce,
+            }
+
+            first = await client.post("/api/chat", json={"message": "hello"}, headers=headers)
+            await first.aread()
+            replay = await client.post("/api/chat", json={"message": "hello"}, headers=headers)
+
+    assert first.status_code == 200
+    assert replay.status_code == 401
+
+
+def _replay_headers(client, nonce):
+    return {
+        "X-CSRF-Token": client.cookies.get("csrftoken"),
+        "X-TS": str(int(time.time())),
+        "X-Nonce": nonce,
+    }
+
+
+@pytest.mark.anyio
+async def test_chat_rejects_reused_opaque_nonce():
+    nonce = secrets.token_hex(16)
+    async with LifespanManager(app):
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            await client.get("/healthz")
+            headers = _replay_headers(client, nonce)
+            first = await client.post("/api/chat", json={"message": "hello"}, headers=headers)
+            replay = await client.post("/api/chat", json={"message": "hello"}, headers=headers)
+
+    assert first.status_code == 200
+    assert replay.status_code == 401
+
+
+@pytest.mark.anyio
+async def test_chat_accepts_opaque_nonce_again_after_it_expires():
+    nonce = secrets.token_hex(16)
+    key = hash(nonce.encode())
+    async with LifespanManager(app):
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            await client.get("/healthz")
+            first = await client.post(
+                "/api/chat", json={"message": "hello"}, headers=_replay_headers(client, nonce)
+            )
+
+            # age the cached entry past its expiry
+            anti_replay.NONCES[key] = 0
+            anti_replay._NONCE_HEAP[:] = [
+                (0 if entry_key == key else expires, entry_key, entry_client)
+                for expires, entry_key, entry_client in anti_replay._NONCE_HEAP
+            ]
+            heapq.heapify(anti_replay._NONCE_HEAP)
+
+            again = await client.post(
+                "/api/chat", json={"message": "hello"}, headers=_replay_headers(client, nonce)
+            )
+
+    assert first.status_code == 200
+    assert again.status_code == 200
+    assert anti_replay.NONCES[key] > time.time()
+    assert [entry[1] for entry in anti_replay._NONCE_HEAP].count(key) == 1
+    assert len(anti_replay._NONCE_HEAP) == len(anti_replay.NONCES)
+
+
+@pytest.mark.anyio
+async def test_chat_rejects_new_nonces_when_cache_is_full(monkeypatch):
+    monkeypatch.setattr(anti_replay, "ANTI_REPLAY_MAX_NONCES", len(anti_replay.NONCES) + 1)
+    kept = secrets.token_hex(16)
+    async with LifespanManager(app):
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            await client.get("/healthz")
+            accepted = await client.post(
+                "/api/chat", json={"message": "hello"}, headers=_replay_headers(client, kept)
+            )
+            overflow = await client.post(
+                "/api/chat",
+                json={"message": "hello"},
+                headers=_replay_headers(client, secrets.token_hex(16)),
+            )
+            replay = await client.post(
+                "/api/chat", json={"message": "hello"}, headers=_replay_headers(client, kept)
+            )
+
+    assert accepted.status_code == 200
+    assert overflow.status_code == 401
+    assert replay.status_code == 401
+
+
+@pytest.mark.anyio
+async def test_chat_returns_single_response_without_delay(monkeypatch):
+    monkeypatch.setattr(app_module, "settings", replace(app_module.settings, delay_ms=0))
+    async with LifespanManager(app):
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            await client.get("/healthz")
+            response = await client.post(
+                "/api/chat",
+                json={"message": "hello"},
+                headers=_replay_headers(client, secrets.token_hex(16)),
+            )
+
+    assert response.status_code == 200
+    assert response.headers["content-length"] == str(len(PLACEHOLDER_TEXT.encode("utf-8")))
+    assert response.headers["cache-control"] == "no-cache"
+    assert response.text == PLACEHOLDER_TEXT
+
+
+@pytest.mark.anyio
+async def test_chat_rejects_tampered_signed_nonce():
+    async with LifespanManager(app):
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            nonce = (await client.get("/nonce")).json()["nonce"]
+            tampered = nonce[:-1] + ("0" if nonce[-1] != "0" else "1")
+            response = await client.post(
+                "/api/chat", json={"message": "hello"}, headers=_replay_headers(client, tampered)
+            )
+
+    assert response.status_code == 401
+
+
+@pytest.mark.anyio
+async def test_chat_rejects_signed_nonce_from_another_session():
+    async with LifespanManager(app):
+        async with AsyncClient(app=app, base_url="http://test") as issuer:
+            nonce = (await issuer.get("/nonce")).json()["nonce"]
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            await client.get("/healthz")
+            response = await client.post(
+                "/api/chat", json={"message": "hello"}, headers=_replay_headers(client, nonce)
+            )
+
+    assert response.status_code == 401
+
+
+@pytest.mark.anyio
+async def test_chat_rejects_lower_signed_seq_after_higher():
+    async with LifespanManager(app):
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            older = (await client.get("/nonce")).json()["nonce"]
+            newer = (await client.get("/nonce")).json()["nonce"]
+            accepted = await client.post(
+                "/api/chat", json={"message": "hello"}, headers=_replay_headers(client, newer)
+            )
+            rejected = await client.post(
+                "/api/chat", json={"message": "hello"}, headers=_replay_headers(client, older)
+            )
+
+    assert accepted.status_code == 200
+    assert rejected.status_code == 401
+
+
+def test_signed_nonce_rejection_reasons():
+    session_id, session = "sid-under-test", Session(time.time())
+    other_id = "other-sid"
+    SESSIONS[session_id] = session
+    now = int(time.time())
+
+    def check(nonce, sid=session_id):
+        scope = {"headers": [(b"cookie", f"sid={sid}".encode())] if sid else []}
+        return anti_replay._accept_signed_nonce(
+            scope, anti_replay._SIGNED_NONCE.fullmatch(nonce.encode()), now
+        )
+
+    try:
+        first = issue_nonce(session_id, session)
+        second = issue_nonce(session_id, session)
+        stale_ts = now - anti_replay.FRESHNESS_WINDOW - 1
+        stale = f"{stale_ts}:9:{anti_replay._sign_nonce(stale_ts, 9, session_id)}"
+        orphan = f"{now}:1:{anti_replay._sign_nonce(now, 1, other_id)}"
+
+        assert check(stale) == "stale_nonce"
+        assert check(first, sid=None) == "unknown_session"
+        assert check(first, sid=other_id) == "invalid_nonce"
+        assert check(orphan, sid=other_id) == "unknown_session"
+        assert check(second) is None
+        assert check(first) == "nonce_reuse"
+    finally:
+        SESSIONS.pop(session_id, None)
+
+
+@pytest.mark.anyio
+async def test_chat_treats_colon_nonce_without_signed_shape_as_opaque():
+    async with LifespanManager(app):
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            await client.get("/healthz")
+            response = await client.post(
+                "/api/chat",
+                json={"message": "hello"},
+                headers=_replay_headers(client, f"client:{secrets.token_hex(8)}"),
+            )
+
+    assert response.status_code == 200
+
+
+def test_nonce_quota_is_per_client(monkeypatch):
+    monkeypatch.setattr(anti_replay, "ANTI_REPLAY_MAX_NONCES_PER_IP", 2)
+    expires = int(time.time()) + anti_replay.FRESHNESS_WINDOW
+    keys = [hash(secrets.token_bytes(16)) for _ in range(4)]
+
+    assert anti_replay._remember_nonce(keys[0], expires, "203.0.113.7") is None
+    assert anti_replay._remember_nonce(keys[1], expires, "203.0.113.7") is None
+    assert anti_replay._remember_nonce(keys[2], expires, "203.0.113.7") == "nonce_quota_exceeded"
+    assert keys[2] not in anti_replay.NONCES
+    assert anti_replay._remember_nonce(keys[3], expires, "203.0.113.8") is None
+
+    anti_replay._purge_nonces(expires)
+    assert "203.0.113.7" not in anti_replay._NONCES_PER_IP
+    assert anti_replay._remember_nonce(keys[2], expires + 1, "203.0.113.7") is None
+
+
+@pytest.mark.anyio
+async def test_anti_replay_uses_first_repeated_header():
+    async with LifespanManager(app):
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            await client.get("/healthz")
+            headers = [
+                ("X-CSRF-Token", client.cookies.get("csrftoken")),
+                ("X-TS", str(int(time.time()))),
+                ("X-TS", "0"),
+                ("X-Nonce", secrets.token_hex(16)),
+            ]
+            response = await client.post("/api/chat", json={"message": "hello"}, headers=headers)
+
+    assert response.status_code == 200
+
+
+@pytest.mark.anyio
+async def test_chat_rejects_invalid_utf8_payload():
+    async with LifespanManager(app):
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            await client.get("/healthz")
+            headers = _replay_headers(client, secrets.token_hex(16))
+            headers["Content-Type"] = "application/json"
+            response = await client.post(
+                "/api/chat", content=b'{"message":"\xff"}', headers=headers
+            )
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid JSON payload"}
+
+
+@pytest.mark.anyio
+async def test_chat_rejects_oversized_payload_before_parsing():
+    async with LifespanManager(app):
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            await client.get("/healthz")
+            headers = _replay_headers(client, secrets.token_hex(16))
+            headers["Content-Type"] = "application/json"
+            response = await client.post(
+                "/api/chat", content=b"x" * (app_module.MAX_PAYLOAD_BYTES + 1), headers=headers
+            )
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Payload too large"}
@@ -8,6 +8,7 @@ from httpx import AsyncClient
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
 from app import app  # noqa: E402  pylint: disable=wrong-import-position
+from core.sessions import SESSION_TTL, SESSIONS  # noqa: E402  pylint: disable=wrong-import-position
 
 
 @pytest.fixture
@@ -24,3 +25,26 @@ async def test_me_endpoint_returns_session_information():
     assert response.status_code == 200
     payload = response.json()
     assert payload == {"anonymous": True, "user_id": None}
+
+
+def _sid_cookies(response):
+    return [
+        header for header in response.headers.get_list("set-cookie") if header.startswith("sid=")
+    ]
+
+
+@pytest.mark.anyio
+async def test_sid_cookie_only_sent_when_new_or_half_expired():
+    async with LifespanManager(app):
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            first = await client.get("/me")
+            sid = client.cookies.get("sid")
+            second = await client.get("/me")
+
+            SESSIONS[sid].cookie_set_at -= SESSION_TTL / 2
+            refreshed = await client.get("/me")
+
+    assert len(_sid_cookies(first)) == 1
+    assert sid is not None
+    assert _sid_cookies(second) == []
+    assert _sid_cookies(refreshed) == [_sid_cookies(first)[0]]
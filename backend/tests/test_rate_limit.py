@@ -0,0 +1,76 @@
+import sys
+from pathlib import Path
+
+import pytest
+from asgi_lifespan import LifespanManager
+from httpx import ASGITransport, AsyncClient
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app import app  # noqa: E402  pylint: disable=wrong-import-position
+from core import rate_limit  # noqa: E402  pylint: disable=wrong-import-position
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def clear_buckets():
+    def clear():
+        # the middleware binds these containers as defaults, so clear in place
+        rate_limit._IP_SLOT.clear()
+        del rate_limit._TOKENS[:]
+        del rate_limit._LAST[:]
+        rate_limit._FREE_SLOTS.clear()
+
+    clear()
+    yield
+    clear()
+
+
+def _client(ip):
+    transport = ASGITransport(app=app, client=(ip, 123))
+    return AsyncClient(transport=transport, base_url="http://test")
+
+
+@pytest.mark.anyio
+async def test_burst_is_exhausted_then_refills():
+    burst = int(rate_limit.RATE_LIMIT_BURST)
+    async with LifespanManager(app):
+        async with _client("198.51.100.1") as client:
+            statuses = [(await client.get("/healthz")).status_code for _ in range(burst)]
+            limited = await client.get("/healthz")
+
+            # one second of refill, applied by rewinding the bucket's timestamp
+            rate_limit._LAST[rate_limit._IP_SLOT["198.51.100.1"]] -= 1_000_000_000
+            refilled = await client.get("/healthz")
+
+    assert statuses == [200] * burst
+    assert limited.status_code == 429
+    assert refilled.status_code == 200
+
+
+@pytest.mark.anyio
+async def test_least_recently_seen_client_is_evicted(monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_MAX_IPS", 2)
+    async with LifespanManager(app):
+        for ip in ("198.51.100.1", "198.51.100.2", "198.51.100.1", "198.51.100.3"):
+            async with _client(ip) as client:
+                assert (await client.get("/healthz")).status_code == 200
+
+    assert list(rate_limit._IP_SLOT) == ["198.51.100.1", "198.51.100.3"]
+    assert len(rate_limit._TOKENS) == 2
+
+
+@pytest.mark.anyio
+async def test_zero_cap_keeps_serving(monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_MAX_IPS", 0)
+    ips = ("198.51.100.1", "198.51.100.2", "198.51.100.3")
+    async with LifespanManager(app):
+        for ip in ips:
+            async with _client(ip) as client:
+                assert (await client.get("/healthz")).status_code == 200
+
+    assert list(rate_limit._IP_SLOT) == list(ips)
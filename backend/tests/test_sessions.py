@@ -0,0 +1,32 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from core import sessions  # noqa: E402  pylint: disable=wrong-import-position
+
+
+def _heap_entries(sid):
+    return [entry for entry in sessions._EXPIRE_HEAP if entry[1] == sid]
+
+
+def test_collect_expired_drops_reschedules_and_skips_removed():
+    expired_sid, expired = sessions._create_session()
+    touched_sid, touched = sessions._create_session()
+    removed_sid, _ = sessions._create_session()
+
+    now = time.time() + sessions.SESSION_TTL + 1
+    expired.last_seen -= 10
+    touched.last_seen = now - 5
+    sessions.SESSIONS.pop(removed_sid)
+
+    sessions._collect_expired(now)
+
+    assert expired_sid not in sessions.SESSIONS
+    assert _heap_entries(expired_sid) == []
+
+    assert sessions.SESSIONS[touched_sid] is touched
+    assert _heap_entries(touched_sid) == [(touched.last_seen + sessions.SESSION_TTL, touched_sid)]
+
+    assert _heap_entries(removed_sid) == []